@@ -1,15 +1,28 @@
 import gc
+import os
+
 import torch
 
 from ..init_helper import get_logger
 
 logger = get_logger()
 
+# Return cached blocks to the device only when free memory drops below this
+# fraction of the total device memory.
+EMPTY_CACHE_FREE_MEMORY_RATIO = 0.1
+
 def log_cuda_memory_usage():
     cuda_allocated = torch.cuda.memory_allocated() / 1048576
     cuda_reserved = torch.cuda.memory_reserved() / 1048576
     logger.info(f"CUDA memory allocated = {cuda_allocated:.3f} MB, reserved = {cuda_reserved:.3f} MB")
 
 def free_torch_cuda_memory():
-    gc.collect()
-    torch.cuda.empty_cache()
+    # Tensors are freed by reference counting, a full gc pass over all python
+    # objects is only needed to break reference cycles, so it is opt-in.
+    if os.getenv("PARAM_FORCE_GC", "0").lower() in ("1", "true", "yes"):
+        gc.collect()
+    # Querying memory would create a CUDA context for CPU only runs.
+    if torch.cuda.is_initialized():
+        free_memory, total_memory = torch.cuda.mem_get_info()
+        if free_memory < total_memory * EMPTY_CACHE_FREE_MEMORY_RATIO:
+            torch.cuda.empty_cache()
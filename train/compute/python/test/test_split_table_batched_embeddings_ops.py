@@ -0,0 +1,168 @@
+import unittest
+
+import pytest
+
+pytest.importorskip("fbgemm_gpu")
+
+import torch
+
+from ..workloads.pytorch.split_table_batched_embeddings_ops import (
+    SplitTableBatchedEmbeddingBagsCodegenInputIterator,
+    generate_requests,
+)
+
+
+def reference_requests(B, Ls, Es, alpha):
+    """
+    Per table reference of the linear sequence requests: each table's indices
+    restart at 0, and offsets of later tables continue from the previous one.
+    """
+    indices_list = []
+    offsets_list = []
+    offset_start = 0
+    for L, E in zip(Ls, Es):
+        indices = torch.arange(0, B * L).long()
+        # tables with L == 0 have no indices, avoid an integer modulo by 0
+        indices_list.append(indices % max(L, 1) if alpha == 0 else indices % E)
+        offsets = offset_start + torch.arange(0, B + 1).long() * L
+        # only the first table keeps the leading offset
+        offsets_list.append(offsets if not offsets_list else offsets[1:])
+        offset_start += B * L
+    return (torch.cat(indices_list), torch.cat(offsets_list))
+
+
+class TestGenerateRequests(unittest.TestCase):
+    # (batch size, pooling factors, emb sizes)
+    cases = [
+        (4, [3], [10]),
+        (3, [2, 2], [5, 9]),
+        (4, [2, 0, 3], [10, 7, 5]),
+        (2, [0], [3]),
+    ]
+
+    def check_sequence(self, alpha):
+        for B, Ls, Es in self.cases:
+            indices, offsets, weights = generate_requests(B, Ls, Es, alpha)
+            expected_indices, expected_offsets = reference_requests(B, Ls, Es, alpha)
+            self.assertTrue(torch.equal(indices, expected_indices), (B, Ls, Es))
+            self.assertTrue(torch.equal(offsets.long(), expected_offsets), (B, Ls, Es))
+            self.assertIsNone(weights)
+
+    def test_sequence_by_pooling_factor(self):
+        self.check_sequence(0.0)
+
+    def test_sequence_by_emb_size(self):
+        self.check_sequence(0.5)
+
+    def check_random(self, alpha):
+        for B, Ls, Es in self.cases:
+            indices, offsets, weights = generate_requests(
+                B, Ls, Es, alpha, weighted=True
+            )
+            _, expected_offsets = reference_requests(B, Ls, Es, alpha)
+            self.assertTrue(torch.equal(offsets.long(), expected_offsets), (B, Ls, Es))
+            self.assertEqual(indices.numel(), sum(B * L for L in Ls))
+            self.assertEqual(weights.shape, indices.shape)
+            self.assertEqual(weights.dtype, torch.float32)
+            table_start = 0
+            for L, E in zip(Ls, Es):
+                table_indices = indices[table_start : table_start + B * L]
+                self.assertTrue(
+                    bool(((table_indices >= 0) & (table_indices < E)).all())
+                )
+                table_start += B * L
+
+    def test_uniform(self):
+        self.check_random(1.0)
+
+    def test_zipf(self):
+        self.check_random(1.5)
+
+
+class TestInputIterator(unittest.TestCase):
+    def test_generator_order(self):
+        configs = {
+            "build": {
+                "args": [
+                    {"type": "int", "name": "num_tables", "value": 2},
+                    {
+                        "type": "genericlist",
+                        "name": "rows",
+                        "value": [
+                            {"type": "int", "value": 10},
+                            {"type": "int", "value": 20},
+                        ],
+                    },
+                    {
+                        "type": "genericlist",
+                        "name": "dim",
+                        "value": [
+                            {"type": "int", "value": 4},
+                            {"type": "int", "value": 8},
+                        ],
+                    },
+                    {"type": "int", "name": "pooling", "value": 0},
+                    {"type": "bool", "name": "weighted", "value": False},
+                    {"type": "str", "name": "weights_precision", "value": "fp16"},
+                ],
+                "kwargs": {},
+            },
+            "input": [
+                {
+                    "args": [
+                        {
+                            "type": "int",
+                            "name": "batch_size",
+                            "__range__": ["value"],
+                            "value": [2, 6, 2],
+                        },
+                        {
+                            "type": "genericlist",
+                            "name": "pooling_factor",
+                            "__list__": ["value"],
+                            "value": [
+                                [
+                                    {"type": "int", "value": 1},
+                                    {"type": "int", "value": 2},
+                                ],
+                                [
+                                    {"type": "int", "value": 3},
+                                    {"type": "int", "value": 4},
+                                ],
+                            ],
+                        },
+                    ]
+                }
+            ],
+        }
+        results = list(
+            SplitTableBatchedEmbeddingBagsCodegenInputIterator(configs, "input", "cpu")
+        )
+
+        expected = [
+            (batch_size, pooling_factors)
+            for batch_size in [2, 4, 6]
+            for pooling_factors in [[1, 2], [3, 4]]
+        ]
+        self.assertEqual(
+            [config_id for config_id, _ in results], [f"0_{i}" for i in range(6)]
+        )
+        self.assertEqual(
+            [
+                (config["args"][3]["value"], config["args"][4].parsed_values)
+                for _, config in results
+            ],
+            expected,
+        )
+        for _, config in results:
+            self.assertEqual(len(config["args"]), 7)
+            self.assertEqual(config["args"][1].parsed_values, [10, 20])
+            self.assertNotIn("__range__", config["args"][3])
+            self.assertNotIn("__list__", config["args"][4])
+        # every config gets its own input arg dicts
+        self.assertIsNot(results[0][1]["args"][3], results[1][1]["args"][3])
+        self.assertIsNot(results[0][1]["args"][4], results[2][1]["args"][4])
+
+
+if __name__ == "__main__":
+    unittest.main()
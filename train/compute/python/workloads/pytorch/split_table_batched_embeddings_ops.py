@@ -1,8 +1,11 @@
-import copy
+import functools
 import gc
+import inspect
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from typing import (
+    Callable,
     Dict,
     Optional,
 )
@@ -22,9 +25,10 @@ from fbgemm_gpu.split_table_batched_embeddings_ops import (
 )
 
 from ...lib.data import register_data_generator
-from ...lib.generator import full_range, TableProduct, IterableList, ListProduct
+from ...lib.generator import full_range
 from ...lib.init_helper import get_logger
 from ...lib.iterator import (
+    META_ATTRS,
     ConfigIterator,
     remove_meta_attr,
     register_config_iterator,
@@ -34,6 +38,30 @@ from ...lib.operator import OperatorInterface, register_operator
 
 logger = get_logger()
 
+try:
+    import numba
+except ModuleNotFoundError:
+    numba = None
+    logger.debug("numba not found, zipf indices will be generated with numpy.")
+
+
+class ParsedGenericList(dict):
+    """
+    A genericlist arg that also carries its item values, parsed once by the
+    input iterator so get_data does not walk the list for every input config.
+    It serializes like the plain arg dict.
+    """
+
+    def __init__(self, arg: Dict[str, Any]):
+        super(ParsedGenericList, self).__init__(arg)
+        self.parsed_values: List[Any] = genericList_to_list(arg)
+
+
+def get_genericlist_values(arg: Dict[str, Any]) -> List[Any]:
+    if isinstance(arg, ParsedGenericList):
+        return arg.parsed_values
+    return genericList_to_list(arg)
+
 
 class SplitTableBatchedEmbeddingBagsCodegenInputIterator(ConfigIterator):
     def __init__(
@@ -48,28 +76,68 @@ class SplitTableBatchedEmbeddingBagsCodegenInputIterator(ConfigIterator):
         logger.debug(f"build_input_config: {configs}")
         build_config = configs["build"]
         logger.debug(f"build_config: {build_config}")
-        self.num_tables = build_config["args"][0]
-        self.rows = build_config["args"][1]
-        self.dim = build_config["args"][2]
-        self.weighted = build_config["args"][4]
-        self.weights_precision = build_config["args"][5]
+        # Build args are the same for every generated input config, remove
+        # their meta attributes once and share them across the yielded configs
+        # instead of deep copying the per table lists on every yield.
+        (
+            self.num_tables,
+            self.rows,
+            self.dim,
+            self.weighted,
+            self.weights_precision,
+        ) = remove_meta_attr(
+            {
+                "args": [
+                    build_config["args"][0],
+                    build_config["args"][1],
+                    build_config["args"][2],
+                    build_config["args"][4],
+                    build_config["args"][5],
+                ]
+            }
+        )["args"]
+        if self.num_tables["value"] > 1:
+            self.rows = ParsedGenericList(self.rows)
         self.generator = self._generator()
 
+    def _values(self, arg: Dict[str, Any]):
+        """
+        Returns a lazy iterable over the arg's range or list values.
+        """
+        if "__range__" in arg:
+            return full_range(*arg["value"])
+        elif "__list__" in arg:
+            return arg["value"]
+        return [arg["value"]]
+
+    def _make_arg(self, arg: Dict[str, Any], value: Any):
+        """
+        Returns a new copy of the arg, without meta attributes, with the value.
+        """
+        new_arg = {k: v for k, v in arg.items() if k not in META_ATTRS}
+        new_arg["value"] = value
+        if new_arg.get("type") == "genericlist":
+            new_arg = ParsedGenericList(new_arg)
+        return new_arg
+
+    def _product(self, args: List[Dict[str, Any]], values: Tuple[Any, ...] = ()):
+        """
+        Lazily yields the Cartesian product of the args' values, iterating each
+        arg's values again for every prefix. Every combination gets its own
+        arg dicts.
+        """
+        if len(values) == len(args):
+            yield [self._make_arg(arg, value) for arg, value in zip(args, values)]
+            return
+        for value in self._values(args[len(values)]):
+            yield from self._product(args, values + (value,))
+
     def _generator(self):
         inputs = self.configs[self.key]
         var_id = 0
         for input in inputs:
-            input_config = copy.deepcopy(input)
-            args = []
-            for arg in input_config["args"]:
-                if "__range__" in arg:
-                    arg["value"] = full_range(*arg["value"])
-                if "__list__" in arg:
-                    arg["value"] = IterableList(arg["value"])
-                args.append(TableProduct(arg))
-
             config_id = 0
-            for arg_config in ListProduct(args):
+            for arg_config in self._product(input["args"]):
                 batch_size = arg_config[0]
                 pooling_factor = arg_config[1]
                 result = {
@@ -84,7 +152,7 @@ class SplitTableBatchedEmbeddingBagsCodegenInputIterator(ConfigIterator):
                     ],
                     "kwargs": {},
                 }
-                yield (f"{var_id}_{config_id}", remove_meta_attr(result))
+                yield (f"{var_id}_{config_id}", result)
                 config_id += 1
 
     def __next__(self):
@@ -97,73 +165,308 @@ register_config_iterator(
 )
 
 
+# Number of zipf samples drawn from one seeded RNG stream by zipf_parallel.
+ZIPF_CHUNK_SIZE = 65536
+
+if numba is not None:
+
+    # No fastmath: U ** (-1 / (alpha - 1)) overflows to inf for alpha close to
+    # 1, and the overflow check below must see it.
+    @numba.njit(parallel=True, cache=True)
+    def zipf_parallel(alpha: float, E: int, seeds: np.ndarray, out: np.ndarray):
+        """
+        Fills out with zipf(alpha) samples modulo E, using the same
+        rejection sampler as numpy (Devroye, Non-Uniform Random Variate
+        Generation, p. 551) across numba worker threads. out is split into
+        len(seeds) chunks, each sampled with numba's RNG seeded by its own
+        seed, so the result does not depend on thread scheduling.
+        """
+        am1 = alpha - 1.0
+        b = 2.0 ** am1
+        size = out.shape[0]
+        num_chunks = seeds.shape[0]
+        chunk_size = (size + num_chunks - 1) // num_chunks
+        for chunk in numba.prange(num_chunks):
+            # seeds the RNG of the thread running this chunk
+            np.random.seed(seeds[chunk])
+            for i in range(chunk * chunk_size, min(size, (chunk + 1) * chunk_size)):
+                while True:
+                    U = 1.0 - np.random.random()
+                    V = np.random.random()
+                    X = np.floor(U ** (-1.0 / am1))
+                    # reject samples that would overflow int64
+                    if X < 1.0 or X > 9.2e18:
+                        continue
+                    T = (1.0 + 1.0 / X) ** am1
+                    if V * X * (T - 1.0) / (b - 1.0) <= T / b:
+                        out[i] = np.int64(X) % E
+                        break
+
+else:
+    zipf_parallel = None
+
+
+def generate_sequence_indices(
+    periods: List[int],
+    B: int,
+    Ls: List[int],
+    device: torch.device,
+) -> torch.Tensor:
+    """
+    Linear sequence modulo each table's period, restarting at the beginning of
+    each table.
+    """
+    table_sizes = [B * L for L in Ls]
+    # write each table's sequence into its slice of one preallocated buffer
+    indices = torch.empty(sum(table_sizes), dtype=torch.int64, device=device)
+    table_start = 0
+    for period, table_size in zip(periods, table_sizes):
+        # tables with a 0 pooling factor have no indices, and a 0 period
+        if table_size == 0:
+            continue
+        table_indices = indices[table_start : table_start + table_size]
+        torch.arange(table_size, out=table_indices)
+        table_indices.remainder_(period)
+        table_start += table_size
+    return indices
+
+
+def generate_pooling_factor_sequence_indices(
+    B: int,
+    Ls: List[int],
+    Es: List[int],
+    device: torch.device,
+) -> torch.Tensor:
+    if len(set(Ls)) == 1:
+        # every bag holds 0, 1, ..., L - 1
+        return torch.arange(Ls[0], dtype=torch.int64, device=device).repeat(
+            B * len(Ls)
+        )
+    return generate_sequence_indices(Ls, B, Ls, device)
+
+
+def generate_emb_size_sequence_indices(
+    B: int,
+    Ls: List[int],
+    Es: List[int],
+    device: torch.device,
+) -> torch.Tensor:
+    if len(Es) == 1:
+        return torch.arange(
+            0, B * Ls[0], dtype=torch.int64, device=device
+        ).remainder_(Es[0])
+    return generate_sequence_indices(Es, B, Ls, device)
+
+
+def generate_uniform_indices(
+    B: int,
+    Ls: List[int],
+    Es: List[int],
+    device: torch.device,
+) -> torch.Tensor:
+    table_sizes = [B * L for L in Ls]
+    if len(set(Es)) == 1:
+        return torch.randint(
+            0, Es[0], (sum(table_sizes),), dtype=torch.int64, device=device
+        )
+    # fill each table's slice of the output in place, avoiding full size
+    # temporaries for the per index emb sizes
+    indices = torch.empty(sum(table_sizes), dtype=torch.int64, device=device)
+    table_start = 0
+    for E, table_size in zip(Es, table_sizes):
+        table_end = table_start + table_size
+        torch.randint(0, E, (table_size,), out=indices[table_start:table_end])
+        table_start = table_end
+    return indices
+
+
+def generate_zipf_indices(
+    alpha: float,
+    B: int,
+    Ls: List[int],
+    Es: List[int],
+    device: torch.device,
+) -> torch.Tensor:
+    # zipf is sampled on host into pinned memory, so the copy to device
+    # can run asynchronously. The modulo by each table's emb size is
+    # written straight into the table's slice of the shared buffer.
+    table_sizes = [B * L for L in Ls]
+    host_indices = torch.empty(
+        sum(table_sizes), dtype=torch.int64, pin_memory=(device.type == "cuda")
+    )
+    host_indices_np = host_indices.numpy()
+    table_indices = []
+    table_start = 0
+    for table_size in table_sizes:
+        table_indices.append(host_indices_np[table_start : table_start + table_size])
+        table_start += table_size
+    if zipf_parallel is not None:
+        for E, out in zip(Es, table_indices):
+            # Chunk seeds are drawn from the global numpy RNG, so
+            # np.random.seed() keeps the samples reproducible.
+            num_chunks = max(1, -(-out.shape[0] // ZIPF_CHUNK_SIZE))
+            seeds = np.random.randint(2**32, size=num_chunks)
+            zipf_parallel(alpha, E, seeds, out)
+    else:
+        # numpy releases the GIL while sampling, so tables are sampled
+        # concurrently, each with its own generator. Seeds are drawn from
+        # the global numpy RNG to keep np.random.seed() reproducible.
+        seeds = np.random.randint(np.iinfo(np.int64).max, size=len(Es))
+
+        def sample_table(E: int, seed: int, out: np.ndarray):
+            rng = np.random.default_rng(seed)
+            np.remainder(rng.zipf(a=alpha, size=out.shape[0]), E, out=out)
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(sample_table, Es, seeds, table_indices))
+    return host_indices.to(device, non_blocking=True)
+
+
+def select_indices_generator(alpha: float) -> Callable:
+    """
+    Resolves the indices distribution once, the returned generator is called
+    as gen_fn(B, Ls, Es, device).
+    alpha == 0: linear sequence by pooling factor
+    alpha <= 0.5: linear sequence by embedding size
+    alpha <= 1.0: use uniform distribution
+    alpha > 1.0: use zjpf distribution
+    """
+    if alpha == 0:
+        return generate_pooling_factor_sequence_indices
+    elif alpha <= 0.5:
+        return generate_emb_size_sequence_indices
+    elif alpha <= 1.0:
+        return generate_uniform_indices
+    else:
+        return functools.partial(generate_zipf_indices, alpha)
+
+
 def generate_requests(
     B: int,  # batch size
-    L: int,  # pooling factor
-    E: int,  # emb size
-    offset_start: int,  # indices offset from previous generator
+    Ls: List[int],  # pooling factor of each table
+    Es: List[int],  # emb size of each table
     # alpha <= 1.0: use uniform distribution
     # alpha > 1.0: use zjpf distribution
     alpha: float = 1.0,
     weighted: bool = False,
-) -> List[Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]]:
-    indices_size = B * L
-    # indices
-    if alpha == 0:
-        # linear sequence by pooling factor
-        indices = torch.arange(0, indices_size).long() % L
-    elif alpha <= 0.5:
-        # linear sequence by embedding size
-        indices = torch.arange(0, indices_size).long() % E
-    elif alpha <= 1.0:
-        indices = torch.randint(
-            low=0,
-            high=E,
-            size=(indices_size,),
-            dtype=torch.int64,
-        )
-    else:
-        indices = torch.as_tensor(np.random.zipf(a=alpha, size=indices_size)).long() % E
+    device: torch.device = torch.device("cpu"),
+    gen_fn: Optional[Callable] = None,  # indices generator, selected by alpha if None
+) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Generates the indices, offsets and per sample weights of all tables in one
+    batched pass. Tables are laid out one after another, table i holds B bags
+    of Ls[i] indices in the range of [0, Es[i]).
+    """
+    indices_size = sum(B * L for L in Ls)
+    # indices, generated directly on the target device to avoid a host to
+    # device copy of the full tensor
+    if gen_fn is None:
+        gen_fn = select_indices_generator(alpha)
+    indices = gen_fn(B, Ls, Es, device)
 
     # offsets
-    lengths = np.ones(B, dtype=np.int64) * L
-    # here we want to add the start of previous offset to all the offsets
-    # if offset_start = 0, we insert it in the beginning
-    if offset_start == 0:
-        offsets = torch.tensor(np.cumsum([0] + lengths.tolist()))
+    num_bags = B * len(Ls)
+    if len(set(Ls)) == 1 and Ls[0] > 0:
+        # same pooling factor for all tables, offsets are 0, L, 2L, ..., num_bags * L
+        offsets = torch.arange(
+            0, (num_bags + 1) * Ls[0], Ls[0], dtype=torch.int64, device=device
+        )
     else:
-        offsets = torch.tensor(offset_start + np.cumsum(lengths))
+        # a single prefix sum over the bag lengths of all tables, the complete
+        # cumsum includes the leading 0
+        lengths = torch.tensor(Ls, dtype=torch.int64, device=device).repeat_interleave(
+            B
+        )
+        offsets = torch.ops.fbgemm.asynchronous_complete_cumsum(lengths)
 
     # weights
     weights_tensor = (
-        torch.randn(indices_size, dtype=torch.float32) if weighted else None
+        torch.empty(indices_size, dtype=torch.float32, device=device).normal_()
+        if weighted
+        else None
     )
 
     return (indices, offsets, weights_tensor)
 
 
+# torch.load supports mmap since PyTorch 2.1.
+TORCH_LOAD_MMAP = "mmap" in inspect.signature(torch.load).parameters
+
+
+@functools.lru_cache(maxsize=None)
+def warn_no_load_mmap():
+    # Cached, so the warning is only logged for the first loaded file.
+    logger.warning(
+        f"torch.load does not support mmap in PyTorch {torch.__version__}, tensor files will be loaded without mmap."
+    )
+
+
+def load_tensor(file_name: str, device: torch.device) -> torch.Tensor:
+    """
+    Loads a saved tensor to device. When copying to a non CPU device, the file
+    is memory mapped when supported, so only the pages being copied are read
+    into host memory.
+    """
+    # A memory mapped tensor used directly on CPU would page fault during the
+    # benchmark iterations, so CPU targets are always fully loaded.
+    if not TORCH_LOAD_MMAP:
+        warn_no_load_mmap()
+    elif device.type != "cpu":
+        try:
+            return torch.load(file_name, map_location="cpu", mmap=True).to(device)
+        except RuntimeError as error:
+            # files saved in the legacy (non zipfile) format can not be mmapped
+            logger.debug(f"failed to mmap {file_name}: {error}")
+    return torch.load(file_name, map_location=device)
+
+
+@functools.lru_cache(maxsize=32)
+def generate_cached_requests(
+    B: int,
+    Ls: Tuple[int, ...],
+    Es: Tuple[int, ...],
+    alpha: float,
+    weighted: bool,
+    pin_memory: bool,
+) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Same as generate_requests, but reuses previously generated tensors for
+    identical configs. Only the distribution of the indices matters to the
+    benchmark, not the actual values. Tensors are cached on host, optionally
+    in pinned memory, so the cache never holds device memory.
+    """
+    requests = generate_requests(
+        B, list(Ls), list(Es), alpha, weighted, torch.device("cpu")
+    )
+    if pin_memory:
+        requests = tuple(t.pin_memory() if t is not None else None for t in requests)
+    return requests
+
+
 class SplitTableBatchedEmbeddingBagsCodegenInputDataGenerator:
     def get_data(self, config, device):
         logger.debug(f"data generator config: {config}")
         # batch size * pooling_factor
         num_tables = config["args"][0]["value"]
         if num_tables > 1:
-            rows = genericList_to_list(config["args"][1])
-            pooling_factors = genericList_to_list(config["args"][4])
+            rows = get_genericlist_values(config["args"][1])
+            pooling_factors = get_genericlist_values(config["args"][4])
         else:
             rows = [config["args"][1]["value"]]
             pooling_factors = [config["args"][4]["value"]]
         batch_size = config["args"][3]["value"]
         weighted = config["args"][5]["value"]
 
-        indices_list = []
-        offsets_list = []
-        per_sample_weights_list = []
-        offset_start = 0
         distribution = os.getenv("split_embedding_distribution")
         if distribution is None:
             distribution = 1
         logger.debug(f"distribution = {distribution}")
+        # Cached tensors stay alive in host memory, so caching is opt-in.
+        cache_requests = os.getenv("split_embedding_cache_requests", "0").lower() in (
+            "1",
+            "true",
+            "yes",
+        )
 
         target_device = torch.device(device)
 
@@ -185,36 +488,39 @@ class SplitTableBatchedEmbeddingBagsCodegenInputDataGenerator:
 
         logger.debug(f"indices_file: {indices_file}, offsets_file: {offsets_file}")
         if indices_file is not None and offsets_file is not None:
-            indices_tensor = torch.load(indices_file, map_location=target_device)
-            offsets_tensor = torch.load(offsets_file, map_location=target_device)
+            indices_tensor = load_tensor(indices_file, target_device)
+            offsets_tensor = load_tensor(offsets_file, target_device)
             per_sample_weights_tensor = None
             if weights_file:
-                per_sample_weights_tensor = torch.load(
-                    weights_file, map_location=target_device
-                )
-        else:
-            for i in range(num_tables):
-                indices, offsets, per_sample_weights = generate_requests(
+                per_sample_weights_tensor = load_tensor(weights_file, target_device)
+        elif cache_requests:
+            (
+                indices_tensor,
+                offsets_tensor,
+                per_sample_weights_tensor,
+            ) = (
+                t.to(target_device, non_blocking=True) if t is not None else None
+                for t in generate_cached_requests(
                     batch_size,
-                    pooling_factors[i],
-                    rows[i],
-                    offset_start,
+                    tuple(pooling_factors),
+                    tuple(rows),
                     float(distribution),
                     weighted,
+                    target_device.type == "cuda",
                 )
-                indices_list.append(indices)
-                offsets_list.append(offsets)
-                # update to the offset_start to the last element of current offset
-                offset_start = offsets[-1].item()
-                if weighted:
-                    per_sample_weights_list.append(per_sample_weights)
-
-            indices_tensor = torch.cat(indices_list)
-            offsets_tensor = torch.cat(offsets_list)
-
-            # check for per sample weights
-            per_sample_weights_tensor = (
-                torch.cat(per_sample_weights_list) if weighted else None
+            )
+        else:
+            (
+                indices_tensor,
+                offsets_tensor,
+                per_sample_weights_tensor,
+            ) = generate_requests(
+                batch_size,
+                pooling_factors,
+                rows,
+                weighted=weighted,
+                device=target_device,
+                gen_fn=select_indices_generator(float(distribution)),
             )
 
         logger.debug(f"indices: {indices_tensor.shape}")
@@ -224,11 +530,12 @@ class SplitTableBatchedEmbeddingBagsCodegenInputDataGenerator:
                 f"per_sample_weights: {per_sample_weights_tensor.shape}, {per_sample_weights_tensor}"
             )
 
+        # loaded and generated tensors are already on the target device
         return (
             [
-                indices_tensor.to(target_device),
-                offsets_tensor.to(target_device),
-                per_sample_weights_tensor.to(target_device) if weighted else None,
+                indices_tensor,
+                offsets_tensor,
+                per_sample_weights_tensor if weighted else None,
             ],
             {},
         )
@@ -258,9 +565,10 @@ class SplitTableBatchedEmbeddingBagsCodegenOp(OperatorInterface):
         weighted: bool,
         weights_precision: str,
         optimizer: str,
+        output_dtype: str = "fp32",
     ):
         logger.debug(
-            f"build: [{num_tables}, {rows}, {dims}, {pooling}, {weighted}, {weights_precision}, {optimizer}]"
+            f"build: [{num_tables}, {rows}, {dims}, {pooling}, {weighted}, {weights_precision}, {optimizer}, {output_dtype}]"
         )
         if num_tables == 1:
             rows_list = [rows]
@@ -292,6 +600,7 @@ class SplitTableBatchedEmbeddingBagsCodegenOp(OperatorInterface):
             optimizer=OptimType(optimizer),
             pooling_mode=PoolingMode(pooling),
             weights_precision=SparseType(weights_precision),
+            output_dtype=SparseType(output_dtype),
             stochastic_rounding=True,
             cache_algorithm=CacheAlgorithm.LFU,
             cache_load_factor=0.0,
@@ -309,7 +618,15 @@ class SplitTableBatchedEmbeddingBagsCodegenOp(OperatorInterface):
         self.fwd_out = self.op.forward(args[0], args[1], args[2])
 
     def create_grad(self):
-        self.grad_in = torch.ones_like(self.fwd_out)
+        # grad_in only depends on the forward output's shape, dtype and device,
+        # reuse it across iterations instead of allocating a new one.
+        if (
+            self.grad_in is None
+            or self.grad_in.shape != self.fwd_out.shape
+            or self.grad_in.dtype != self.fwd_out.dtype
+            or self.grad_in.device != self.fwd_out.device
+        ):
+            self.grad_in = torch.ones_like(self.fwd_out)
 
     def backward(self):
         self.fwd_out.backward(self.grad_in)